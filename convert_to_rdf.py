@@ -1,6 +1,7 @@
-import csv
 import wn
 import argparse
+import numpy as np
+import pandas as pd
 
 # Uncomment to download the OEWN
 #wn.download("oewn:2024)
@@ -13,8 +14,53 @@ fix_definitions = {
     "indicating the most important performer or role": "oewn-00888020-a"
     }
 
+WRITE_BUFFER_SIZE = 1 << 20
+
+CSV_COLUMNS = ["hyponym-lemma", "hypo_definition", "hypernym-lemma", "hyper_definition"]
+
+RDF_HEADER = """@prefix oewn: <http://en-word.net/id/> .
+@prefix wn: <http://globalwordnet.github.io/schemas/wn.rdf#>
+
+"""
+
 def comp_defns(def1, def2):
-    return def1 == def2 or def1 in def2 or def2 in def1
+    if def1 == def2:
+        return True
+    # Only the shorter definition can be contained in the longer one
+    if len(def1) < len(def2):
+        return def1 in def2
+    return def2 in def1
+
+def split_lemmas(column):
+    """Return the comma-separated lemmas of a column, one per row, indexed by their row."""
+    return column.str.split(",").explode().str.strip()
+
+def build_index(wordnet, lemmas):
+    """Return a (lemma, synset_id, definition) frame of the synsets of every unique lemma.
+
+    Each lemma is looked up once with wordnet.synsets, which keeps wn's
+    normalization and the order of its results.
+    """
+    records = []
+    definitions = {}
+    for lemma in lemmas.unique():
+        for synset in wordnet.synsets(lemma):
+            if synset.id not in definitions:
+                definitions[synset.id] = synset.definition()
+            records.append((lemma, synset.id, definitions[synset.id]))
+    return pd.DataFrame(records, columns=["lemma", "synset_id", "definition"])
+
+def match_ids(df, index, lemma_col, defn_col):
+    """Return, for each row of df, the id of the first synset matching its lemmas and definition."""
+    lemmas = split_lemmas(df[lemma_col])
+    candidates = lemmas.rename("lemma").rename_axis("row").reset_index().merge(index, on="lemma")
+    row_definitions = df[defn_col].to_numpy()[candidates["row"].to_numpy()]
+    mask = np.fromiter((comp_defns(d1, d2) for d1, d2 in zip(row_definitions, candidates["definition"])),
+                       dtype=bool, count=len(candidates))
+    ids = candidates.loc[mask].groupby("row")["synset_id"].first().reindex(df.index)
+    missing = ids.isna()
+    ids.loc[missing] = [fix_definitions[d] for d in df.loc[missing, defn_col]]
+    return ids
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Convert OEWN to RDF")
@@ -26,40 +72,16 @@ if __name__ == "__main__":
     wordnet = wn.Wordnet("oewn:2024")
 
     # Read the CSV file
-    with open(args.input, "r", encoding="utf-8") as csvfile:
-        with open(args.output, "w", encoding="utf-8") as rdffile:
-            rdffile.write(
-                    """@prefix oewn: <http://en-word.net/id/> .
-@prefix wn: <http://globalwordnet.github.io/schemas/wn.rdf#>
-
-""")
-            reader = csv.DictReader(csvfile, delimiter=";")
-            for row in reader:
-                hypo_lemmas = [lemma.strip() for lemma in row["hyponym-lemma"].split(",")]
-                hypos = [s for hypo_lemma in hypo_lemmas for s in wordnet.synsets(hypo_lemma)]
-                hypos = [h for h in hypos if comp_defns(row["hypo_definition"], h.definition())]
-                if len(hypos) < 1:
-                    hypo_id = fix_definitions[row["hypo_definition"]]
-                else:
-                    hypo_id = hypos[0].id
-
-                hyper_lemmas = [lemma.strip() for lemma in row["hypernym-lemma"].split(",")]
-                hypers = [s for hyper_lemma in hyper_lemmas for s in wordnet.synsets(hyper_lemma)]
-                hypers = [h for h in hypers if comp_defns(row["hyper_definition"], h.definition())]
-
-                if len(hypers) < 1:
-                    hyper_id = fix_definitions[row["hyper_definition"]]
-                else:
-                    hyper_id = hypers[0].id
-
-                if not hyper_id:
-                    print(hypers)
-
-                rdffile.write("oewn:{} wn:hypernym oewn:{} .\n".format(
-                    hypo_id, hyper_id))
-
-
-
-
-
-
+    df = pd.read_csv(args.input, sep=";", usecols=CSV_COLUMNS, dtype=str, keep_default_na=False,
+                     memory_map=True)
+
+    # Look up the synsets of every lemma in the CSV once
+    index = build_index(wordnet, pd.concat([split_lemmas(df["hyponym-lemma"]),
+                                            split_lemmas(df["hypernym-lemma"])]))
+    hypo_ids = match_ids(df, index, "hyponym-lemma", "hypo_definition")
+    hyper_ids = match_ids(df, index, "hypernym-lemma", "hyper_definition")
+    lines = "oewn:" + hypo_ids + " wn:hypernym oewn:" + hyper_ids + " .\n"
+
+    with open(args.output, "w", encoding="utf-8", buffering=WRITE_BUFFER_SIZE) as rdffile:
+        rdffile.write(RDF_HEADER)
+        rdffile.writelines(lines)
@@ -0,0 +1,143 @@
+"""
+Helpers shared by the Gemini prompting scripts: the response cache,
+retries of transient API errors, prompt file I/O and process sharding.
+"""
+
+import os
+import asyncio
+import hashlib
+import mmap
+import random
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+class ResponseCache:
+    """Disk cache of responses keyed by SHA-256 of model, generation parameters and prompt."""
+
+    def __init__(self, model_name, generation_config, cache_dir=None):
+        self.cache_dir = cache_dir
+        self._config_key = (f"{model_name}|{generation_config['temperature']}|"
+                            f"{generation_config['top_p']}|{generation_config['max_output_tokens']}")
+
+    def path(self, prompt):
+        """Return the cache file of a prompt for the current model and generation parameters."""
+        key = hashlib.sha256(f"{self._config_key}|{prompt}".encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f"{key}.txt")
+
+    def load(self, prompt):
+        """Return the cached response of a prompt, or None on a cache miss."""
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self.path(prompt), 'r', encoding='utf-8') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def save(self, prompt, response):
+        """Store a generated response in the cache."""
+        if not self.cache_dir:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.path(prompt)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(response)
+        os.replace(tmp_path, path)
+
+def is_transient(error):
+    """Return whether an API error is worth retrying."""
+    try:
+        from google.api_core import exceptions
+    except ImportError:
+        return False
+    return isinstance(error, (
+        exceptions.ResourceExhausted,
+        exceptions.ServiceUnavailable,
+        exceptions.InternalServerError,
+        exceptions.DeadlineExceeded,
+    ))
+
+def retry_delay(error, attempt, initial_delay=1, max_delay=30):
+    """Return the delay before the next attempt, honoring the server's RetryInfo if present."""
+    for detail in getattr(error, 'details', None) or []:
+        delay = getattr(detail, 'retry_delay', None)
+        if delay is not None:
+            return delay.seconds + delay.nanos / 1e9
+    # Exponential backoff with jitter
+    return min(max_delay, initial_delay * 2 ** attempt) + random.uniform(0, 1)
+
+async def with_retries(request, max_attempts=5, initial_delay=1, max_delay=30):
+    """Await request(), retrying transient errors with exponential backoff; re-raise others."""
+    for attempt in range(max_attempts):
+        try:
+            return await request()
+        except Exception as e:
+            if attempt == max_attempts - 1 or not is_transient(e):
+                raise
+            delay = retry_delay(e, attempt, initial_delay, max_delay)
+            print(f"Transient API error ({e}), retrying in {delay:.1f} seconds...")
+            await asyncio.sleep(delay)
+
+def list_prompt_files(input_dir, names=None):
+    """Return the directory entries of the .txt prompt files in input_dir, largest first.
+
+    If names is given, only the files with those names that still exist are returned.
+    """
+    names = set(names) if names is not None else None
+    with os.scandir(input_dir) as it:
+        entries = [entry for entry in it if entry.name.endswith('.txt') and entry.is_file()
+                   and (names is None or entry.name in names)]
+    # Start the longest requests first so short ones fill in at the end
+    entries.sort(key=lambda entry: entry.stat().st_size, reverse=True)
+    return entries
+
+def read_prompt(entry, mmap_min_size=4096):
+    """Read a prompt file, memory-mapping it when it is larger than mmap_min_size bytes."""
+    if entry.stat().st_size > mmap_min_size:
+        with open(entry.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            # Decode straight from the mapping, with the same newline handling as text mode
+            with memoryview(mm) as view:
+                text = str(view, 'utf-8').replace('\r\n', '\n').replace('\r', '\n')
+    else:
+        with open(entry.path, 'r', encoding='utf-8') as f:
+            text = f.read()
+    return text.strip()
+
+def write_output(path, text):
+    """Write a response or error message to an output file."""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+def shard_count(processes, max_concurrent, requests_per_minute=None):
+    """Return how many of processes can run while each keeps a whole share of the limits.
+
+    Every process needs at least one of the max_concurrent request slots and one
+    request per minute of the quota; asking for more processes than that would
+    exceed the concurrency cap or leave workers with a rate limiter that never admits
+    a request.
+    """
+    limit = max_concurrent
+    if requests_per_minute:
+        limit = min(limit, int(requests_per_minute))
+    count = max(1, min(processes, limit))
+    if count < processes:
+        print(f"Using {count} processes instead of {processes}, so that each gets at least "
+              f"one concurrent request and one request per minute")
+    return count
+
+def run_sharded(worker, entries, processes):
+    """Split entries round-robin into shards and call worker(filenames, processes) on each.
+
+    Every shard runs in its own process, so worker must be a module-level function
+    that sets up its own model and event loop.
+    """
+    # Directory entries cannot be pickled, so shards are sent as file names
+    shards = [[entry.name for entry in entries[i::processes]] for i in range(processes)]
+
+    # Spawn rather than fork so workers do not inherit this process's gRPC state
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(processes, mp_context=context) as pool:
+        futures = [pool.submit(worker, shard, processes) for shard in shards if shard]
+        for future in futures:
+            future.result()
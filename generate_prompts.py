@@ -1,22 +1,15 @@
 import pandas as pd
 import os
+import re
 
 # === Configuration ===
 input_csv = "./data/adj_def_disambig.csv"   # input file
 output_dir = "output_directory"        # output directory
 
-# Create output directory if not already existing
-os.makedirs(output_dir, exist_ok=True)
-
-# Read CSV
-df = pd.read_csv(input_csv)
-
-# Cycle each row and generate a txt file
-for idx, row in df.iterrows():
-    hyponym = str(row["hyponym"]).strip()
-    definition = str(row["definition"]).strip()
+# Characters other than str.isalnum() ones, " ", "_" and "-" are replaced
+UNSAFE_FILENAME_CHARS = re.compile(r"[^\w -]")
 
-    prompt = f"""Given the hyponym adjective "{hyponym}" with definition "{definition}", generate a list of related adjective hypernyms. Only a list of adjective hypernyms must be in the output, nothing else more. Do not re-generate the input hyponym. Respect the following guidelines:
+PROMPT_TEMPLATE = """Given the hyponym adjective "{hyponym}" with definition "{definition}", generate a list of related adjective hypernyms. Only a list of adjective hypernyms must be in the output, nothing else more. Do not re-generate the input hyponym. Respect the following guidelines:
 
     - The hyponym and the hypernym must be different.
     - The hyponym and the hypernym must not pertain to the same synset in the Open English WordNet.
@@ -33,8 +26,20 @@ for idx, row in df.iterrows():
 
 """
 
+# Create output directory if not already existing
+os.makedirs(output_dir, exist_ok=True)
+
+# Read CSV
+df = pd.read_csv(input_csv)
+
+# Cycle each row and generate a txt file
+hyponyms = df["hyponym"].astype(str).str.strip().to_numpy()
+definitions = df["definition"].astype(str).str.strip().to_numpy()
+for idx, (hyponym, definition) in enumerate(zip(hyponyms, definitions)):
+    prompt = PROMPT_TEMPLATE.format(hyponym=hyponym, definition=definition)
+
     # File name: hyponym.txt
-    safe_filename = "".join(c if c.isalnum() or c in (" ", "_", "-") else "_" for c in hyponym)
+    safe_filename = UNSAFE_FILENAME_CHARS.sub("_", hyponym)
     output_path = os.path.join(output_dir, f"{safe_filename}_{idx}.txt")
 
     # ...
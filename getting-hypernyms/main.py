@@ -4,12 +4,18 @@ main.py
 
 """
 
+from __future__ import annotations
+
 import os
 import time
 import argparse
 import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib  import Path
-from ollama import Client
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from ollama import Client
 
 
 DEFAULT_MODEL = os.getenv("MODEL_NAME", "llama2")
@@ -17,12 +23,17 @@ DEFAULT_INPUT_DIR = os.getenv("INPUT_DIR", "prompts_directory")
 DEFAULT_OUTPUT_DIR = os.getenv("OUTPUT_DIR", "output_directory")
 DEFAULT_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
 DEFAULT_DELAY = float(os.getenv("REQUEST_DELAY", "1"))
+DEFAULT_WORKERS = int(os.getenv("MAX_WORKERS", "8"))
+
+# Prefixes of the markers written in place of a response when a request fails
+ERROR_PREFIXES = ("[Error", "[Processing Error")
 
 logging.basicConfig(level=logging.INFO, format="%(message)s")
 logger = logging.getLogger("clean-responses")
 
 def setup_client(host: str) -> Client:
     try:
+        from ollama import Client
         client = Client(host=host)
         return client
     except Exception as e:
@@ -37,29 +48,49 @@ def generate_response(client: Client, model: str, prompt: str) -> str:
     except Exception as e:
         return f"[Error: {e}]"
 
-def process_files(client: Client, model: str, input_dir: Path, output_dir: Path, delay: float):
+def is_processed(dst_path: Path) -> bool:
+    if not dst_path.exists() or dst_path.stat().st_size == 0:
+        return False
+    with dst_path.open(encoding="utf-8") as f:
+        head = f.read(max(len(prefix) for prefix in ERROR_PREFIXES))
+    return not head.startswith(ERROR_PREFIXES)
+
+def process_file(client: Client, model: str, src_path: Path, dst_path: Path, delay: float) -> str:
+    try:
+        prompt = src_path.read_text(encoding="utf-8").strip()
+        if not prompt:
+            return "(empty prompt, skipping)"
+        response = generate_response(client, model, prompt)
+        dst_path.write_text(response, encoding="utf-8")
+        status = "Response saved"
+    except Exception as e:
+        logger.error(f"  Error processing {src_path.name}: {e}")
+        dst_path.write_text(f"[Processing Error: {e}]", encoding="utf-8")
+        status = "Processing error"
+    if delay > 0:
+        time.sleep(delay)
+    return status
+
+def process_files(client: Client, model: str, input_dir: Path, output_dir: Path, delay: float, workers: int, overwrite: bool = False):
     output_dir.mkdir(parents=True, exist_ok=True)
-    txt_files = sorted([p for p in input_dir.iterdir() if p.suffix == ".txt"])
+    # Largest prompts first, so the longest requests do not start last
+    txt_files = sorted(input_dir.glob("*.txt"), key=lambda path: path.stat().st_size, reverse=True)
     if not txt_files:
         logger.info(f"No .txt files found in {input_dir}")
         return
-    logger.info(f"Processing {len(txt_files)} files (model={model})...")
-    for i, src_path in enumerate(txt_files, start=1):
-        dst_path = output_dir / src_path.name
-        logger.info(f"[{i}/{len(txt_files)}] {src_path.name}")
-        try:
-            prompt = src_path.read_text(encoding="utf-8").strip()
-            if not prompt:
-                logger.info("  (empty prompt, skipping)")
-                continue
-            response = generate_response(client, model, prompt)
-            dst_path.write_text(response, encoding="utf-8")
-            logger.info("  Response saved")
-        except Exception as e:
-            logger.error(f"  Error processing {src_path.name}: {e}")
-            dst_path.write_text(f"[Processing Error: {e}]", encoding="utf-8")
-        if delay > 0 and i < len(txt_files):
-            time.sleep(delay)
+    if not overwrite:
+        pending = [p for p in txt_files if not is_processed(output_dir / p.name)]
+        if len(pending) < len(txt_files):
+            logger.info(f"Skipping {len(txt_files) - len(pending)} files with existing responses (use --overwrite to redo them)")
+        txt_files = pending
+    logger.info(f"Processing {len(txt_files)} files (model={model}, workers={workers})...")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(process_file, client, model, src_path, output_dir / src_path.name, delay): src_path
+            for src_path in txt_files
+        }
+        for i, future in enumerate(as_completed(futures), start=1):
+            logger.info(f"[{i}/{len(txt_files)}] {futures[future].name}: {future.result()}")
     logger.info(f"\nComplete! Clean responses saved to {output_dir}/")
 
 def main():
@@ -68,7 +99,9 @@ def main():
     parser.add_argument("--input-dir", default=DEFAULT_INPUT_DIR, help="Directory with .txt prompt files")
     parser.add_argument("--output-dir", default=DEFAULT_OUTPUT_DIR, help="Directory to save responses")
     parser.add_argument("--host", default=DEFAULT_HOST, help="Ollama host (e.g. http://localhost:11434)")
-    parser.add_argument("--delay", type=float, default=DEFAULT_DELAY, help="Seconds to wait between requests")
+    parser.add_argument("--delay", type=float, default=DEFAULT_DELAY, help="Seconds each worker waits between requests")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Number of concurrent requests sent to Ollama")
+    parser.add_argument("--overwrite", action="store_true", help="Regenerate responses that already exist in the output directory")
     args = parser.parse_args()
     input_dir = Path(args.input_dir)
     output_dir = Path(args.output_dir)
@@ -77,7 +110,7 @@ def main():
         logger.info(f"Created {input_dir}. Add .txt prompt files there and re-run.")
         return
     client = setup_client(args.host)
-    process_files(client, args.model, input_dir, output_dir, args.delay)
+    process_files(client, args.model, input_dir, output_dir, args.delay, args.workers, args.overwrite)
 
 if __name__ == "__main__":
     main()
@@ -6,9 +6,18 @@
 
 import os
 import json
-import time
-import google.generativeai as genai
+import asyncio
+import tempfile
 from datetime import datetime
+from rate_limiter import AsyncRateLimiter
+from gemini_utils import (ResponseCache, with_retries,
+                          list_prompt_files, read_prompt, write_output,
+                          shard_count, run_sharded)
+
+try:
+    import orjson
+except ImportError:  # fall back to the standard library
+    orjson = None
 
 # === Configuration ===
 
@@ -21,8 +30,40 @@ MAX_OUTPUT_TOKENS = 2048
 TEMPERATURE = 0.7
 TOP_P = 0.9
 
+# Built once and shared by every model instance; the SDK accepts a plain mapping
+GENERATION_CONFIG = {
+    'max_output_tokens': MAX_OUTPUT_TOKENS,
+    'temperature': TEMPERATURE,
+    'top_p': TOP_P,
+}
+
 # Rate limiting 
-REQUEST_DELAY = 1  # seconds between requests
+REQUESTS_PER_MINUTE = 60  # request quota, enforced with a token bucket (None to disable)
+MAX_CONCURRENT_REQUESTS = 8  # requests in flight at the same time
+MMAP_MIN_SIZE = 4096  # prompt files larger than this (bytes) are read through mmap
+NUM_PROCESSES = 1  # worker processes, each with its own event loop and an equal share of the quota
+
+# Gemini Batch API: at least this many pending prompts are submitted as one
+# asynchronous batch job at reduced cost (None to always send online requests).
+# Requires the google-genai package; online requests are used without it.
+BATCH_MIN_FILES = 20
+BATCH_POLL_INTERVAL = 30  # seconds between batch job status checks
+BATCH_JOB_FILE = ".batch_job"  # name of the running batch job in OUTPUT_DIR, to resume polling it (not a .txt file)
+
+# Append-only log of processed files in OUTPUT_DIR, used to resume interrupted runs
+SUMMARY_LOG = "summary.jsonl"
+
+# Retries of transient API errors (rate limits, overload, timeouts)
+MAX_ATTEMPTS = 5
+RETRY_INITIAL_DELAY = 1  # seconds, doubled after every failed attempt
+RETRY_MAX_DELAY = 30
+
+# Response cache, keyed by model, generation parameters and prompt (None to disable).
+# Generation is sampled, so a cache hit returns an old sample instead of a new one:
+# only set it (e.g. ".llm_cache") to re-run with the same responses.
+CACHE_DIR = None
+
+response_cache = ResponseCache(MODEL_NAME, GENERATION_CONFIG, CACHE_DIR)
 
 def setup_api():
     """Initialize the Google AI Studio API."""
@@ -45,17 +86,15 @@ def setup_api():
         return None
 
     try:
+        import google.generativeai as genai
+
         # Configure the API
         genai.configure(api_key=api_key)
 
         # Create model instance
         model = genai.GenerativeModel(
             model_name=MODEL_NAME,
-            generation_config=genai.types.GenerationConfig(
-                max_output_tokens=MAX_OUTPUT_TOKENS,
-                temperature=TEMPERATURE,
-                top_p=TOP_P,
-            )
+            generation_config=GENERATION_CONFIG,
         )
 
         print(f"Successfully initialized Google AI Studio API with model: {MODEL_NAME}")
@@ -65,129 +104,394 @@ def setup_api():
         print(f"Error setting up Google AI Studio API: {e}")
         return None
 
-def generate_response(model, prompt):
-    """Generate response for a given prompt using Google AI Studio."""
-    try:
+async def generate_response(model, prompt, use_cache=True, limiter=None):
+    """Generate response for a given prompt using Google AI Studio.
+
+    Transient API errors are retried; errors that persist are raised.
+    """
+    if use_cache:
+        cached = await asyncio.to_thread(response_cache.load, prompt)
+        if cached is not None:
+            return cached
+
+    async def send():
+        if limiter is not None:
+            await limiter.acquire()
+
         # Generate response
-        response = model.generate_content(prompt)
+        return await model.generate_content_async(prompt)
+
+    response = await with_retries(send, MAX_ATTEMPTS, RETRY_INITIAL_DELAY, RETRY_MAX_DELAY)
+
+    # Check if response was blocked
+    if response.candidates[0].finish_reason.name == "SAFETY":
+        return "Response blocked due to safety filters"
+
+    if response.candidates[0].finish_reason.name == "RECITATION":
+        return "Response blocked due to recitation concerns"
+
+    # Extract the text response
+    if response.text:
+        text = response.text.strip()
+        if use_cache:
+            await asyncio.to_thread(response_cache.save, prompt, text)
+        return text
+    else:
+        return "No response generated"
+
+def dumps_json(obj):
+    """Serialize obj to one line of JSON, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj).decode('utf-8')
+    return json.dumps(obj)
+
+def loads_json(line):
+    """Parse one line of JSON, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(line)
+    return json.loads(line)
+
+def read_summary_log(path):
+    """Return the records of the processing log, ignoring a truncated last line."""
+    records = []
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(loads_json(line))
+                except json.JSONDecodeError:
+                    continue
+    except FileNotFoundError:
+        pass
+    return records
+
+async def process_file(model, entry, index, total, semaphore, limiter, summary_log):
+    """Generate and save the response for a single prompt file."""
+    filename = entry.name
+    output_path = os.path.join(OUTPUT_DIR, filename)
+
+    async with semaphore:
+        print(f"\nProcessing {index}/{total}: {filename}")
 
-        # Check if response was blocked
-        if response.candidates[0].finish_reason.name == "SAFETY":
-            return "Response blocked due to safety filters"
+        try:
+            # Read prompt (file I/O runs in a worker thread, overlapping other requests)
+            prompt = await asyncio.to_thread(read_prompt, entry, MMAP_MIN_SIZE)
 
-        if response.candidates[0].finish_reason.name == "RECITATION":
-            return "Response blocked due to recitation concerns"
+            if not prompt:
+                print(f"Warning: {filename} is empty, skipping...")
+                return None
 
-        # Extract the text response
-        if response.text:
-            return response.text.strip()
-        else:
-            return "No response generated"
+            print(f"Generating response for: {filename[:50]}...")
 
-    except Exception as e:
-        return f"Error generating response: {str(e)}"
+            # Generate response
+            response = await generate_response(model, prompt, limiter=limiter)
 
-def process_prompts():
-    """Main function to process all prompts."""
-    # Create output directory
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
+            # Save only the response (no prompt, no metadata)
+            await asyncio.to_thread(write_output, output_path, response)
 
-    # Check if input directory exists
-    if not os.path.exists(INPUT_DIR):
-        print(f"Input directory '{INPUT_DIR}' not found. Creating it...")
-        os.makedirs(INPUT_DIR, exist_ok=True)
-        print(f"Please add your prompt files (.txt) to the '{INPUT_DIR}' directory")
-        return
+            print(f"✓ Saved response to: {output_path}")
 
-    # Setup API
-    model = setup_api()
-    if not model:
-        return
+            record = {
+                'filename': filename,
+                'status': 'success',
+                'prompt_length': len(prompt),
+                'response_length': len(response)
+            }
 
-    # Get all text files in input directory
-    txt_files = [f for f in os.listdir(INPUT_DIR) if f.endswith('.txt')]
+        except Exception as e:
+            error_msg = f"Error processing {filename}: {str(e)}"
+            print(f"✗ {error_msg}")
 
-    if not txt_files:
-        print(f"No .txt files found in '{INPUT_DIR}' directory")
-        return
+            # Save error to output file
+            await asyncio.to_thread(
+                write_output, output_path,
+                f"ERROR: {error_msg}\n\nPrompt file: {filename}\nModel: {MODEL_NAME}\nTime: {datetime.now().isoformat()}"
+            )
 
-    print(f"Found {len(txt_files)} prompt files to process")
+            record = {
+                'filename': filename,
+                'status': 'error',
+                'error': str(e)
+            }
 
-    if REQUEST_DELAY > 0:
-        print(f"Rate limiting enabled: {REQUEST_DELAY} second delay between requests")
+        summary_log.write(dumps_json(record) + '\n')
+        return record
 
-    # Process each file
-    results_summary = []
+def batch_response_text(result):
+    """Return the response text of one Batch API output line and whether it was generated."""
+    if 'response' not in result:
+        raise RuntimeError(result.get('error', 'missing response'))
 
-    for i, filename in enumerate(txt_files, 1):
-        print(f"\nProcessing {i}/{len(txt_files)}: {filename}")
+    candidate = result['response']['candidates'][0]
+    if candidate.get('finishReason') == "SAFETY":
+        return "Response blocked due to safety filters", False
 
-        input_path = os.path.join(INPUT_DIR, filename)
-        output_path = os.path.join(OUTPUT_DIR, filename)
+    if candidate.get('finishReason') == "RECITATION":
+        return "Response blocked due to recitation concerns", False
 
-        try:
-            # Read prompt
-            with open(input_path, 'r', encoding='utf-8') as f:
-                prompt = f.read().strip()
+    text = "".join(part.get('text', '') for part in candidate.get('content', {}).get('parts', [])).strip()
+    if text:
+        return text, True
+    else:
+        return "No response generated", False
 
-            if not prompt:
-                print(f"Warning: {filename} is empty, skipping...")
-                continue
+def submit_batch_job(client, types, prompts):
+    """Upload the prompts as a JSONL request file and create a batch job for them."""
+    # The request file holds every prompt, so it is kept out of OUTPUT_DIR
+    fd, requests_path = tempfile.mkstemp(prefix='batch_requests_', suffix='.jsonl')
+    try:
+        with open(fd, 'w', encoding='utf-8') as f:
+            for filename, prompt in prompts.items():
+                f.write(dumps_json({
+                    'key': filename,
+                    'request': {
+                        'contents': [{'role': 'user', 'parts': [{'text': prompt}]}],
+                        'generationConfig': {
+                            'maxOutputTokens': MAX_OUTPUT_TOKENS,
+                            'temperature': TEMPERATURE,
+                            'topP': TOP_P
+                        }
+                    }
+                }) + '\n')
+
+        uploaded = client.files.upload(
+            file=requests_path,
+            config=types.UploadFileConfig(display_name='hypernymy-prompts', mime_type='jsonl')
+        )
+    finally:
+        os.remove(requests_path)
 
-            print(f"Generating response for: {filename[:50]}...")
+    return client.batches.create(model=MODEL_NAME, src=uploaded.name,
+                                 config={'display_name': 'hypernymy-prompts'})
 
-            # Generate response
-            response = generate_response(model, prompt)
+def resume_batch_job(client, job_path):
+    """Return the batch job recorded in job_path by an interrupted run, or None."""
+    try:
+        with open(job_path, 'r', encoding='utf-8') as f:
+            job_name = f.read().strip()
+    except FileNotFoundError:
+        return None
 
-            # Save only the response (no prompt, no metadata)
-            with open(output_path, 'w', encoding='utf-8') as f:
-                f.write(response)
+    try:
+        job = client.batches.get(name=job_name)
+    except Exception as e:
+        print(f"Could not resume batch job {job_name} ({e}), submitting a new one")
+        clear_batch_job(job_path)
+        return None
+
+    print(f"Resuming batch job {job.name} of an interrupted run")
+    return job
+
+def clear_batch_job(job_path):
+    """Forget the recorded batch job once its results are used or it cannot finish."""
+    try:
+        os.remove(job_path)
+    except FileNotFoundError:
+        pass
+
+async def process_prompts_batch(entries, summary_log):
+    """Process prompt files with one Gemini Batch API job; return False if it could not run.
 
-            # Add to summary
-            results_summary.append({
+    The job name is kept in BATCH_JOB_FILE until its results are saved, so a run
+    interrupted while polling resumes the same job instead of submitting another.
+    """
+    try:
+        from google import genai as genai_client
+        from google.genai import types
+    except ImportError:
+        print("google-genai is not installed, sending online requests instead of a batch job")
+        return False
+
+    # Read all prompts concurrently in worker threads, answering cached ones right away
+    texts = await asyncio.gather(*(asyncio.to_thread(read_prompt, entry, MMAP_MIN_SIZE) for entry in entries))
+    cached_responses = await asyncio.gather(*(asyncio.to_thread(response_cache.load, prompt) for prompt in texts))
+    prompts = {}
+    for entry, prompt, cached in zip(entries, texts, cached_responses):
+        filename = entry.name
+        if not prompt:
+            print(f"Warning: {filename} is empty, skipping...")
+            continue
+
+        if cached is not None:
+            await asyncio.to_thread(write_output, os.path.join(OUTPUT_DIR, filename), cached)
+            summary_log.write(dumps_json({
                 'filename': filename,
                 'status': 'success',
                 'prompt_length': len(prompt),
-                'response_length': len(response)
-            })
+                'response_length': len(cached)
+            }) + '\n')
+        else:
+            prompts[filename] = prompt
 
-            print(f"✓ Saved response to: {output_path}")
+    job_path = os.path.join(OUTPUT_DIR, BATCH_JOB_FILE)
+    if not prompts:
+        clear_batch_job(job_path)
+        return True
+
+    try:
+        client = genai_client.Client(api_key=os.getenv('GOOGLE_AI_STUDIO_API_KEY'))
+        job = resume_batch_job(client, job_path)
+        if job is None:
+            job = submit_batch_job(client, types, prompts)
+            with open(job_path, 'w', encoding='utf-8') as f:
+                f.write(job.name)
+            print(f"Submitted batch job {job.name} with {len(prompts)} prompts")
+
+        finished = {'JOB_STATE_SUCCEEDED', 'JOB_STATE_FAILED', 'JOB_STATE_CANCELLED', 'JOB_STATE_EXPIRED'}
+        while job.state.name not in finished:
+            print(f"Batch job state: {job.state.name}, checking again in {BATCH_POLL_INTERVAL} seconds...")
+            await asyncio.sleep(BATCH_POLL_INTERVAL)
+            job = client.batches.get(name=job.name)
+
+        if job.state.name != 'JOB_STATE_SUCCEEDED':
+            clear_batch_job(job_path)
+            print(f"Batch job ended with state {job.state.name}, sending online requests instead")
+            return False
 
-            # Rate limiting delay
-            if REQUEST_DELAY > 0 and i < len(txt_files):
-                print(f"Waiting {REQUEST_DELAY} seconds before next request...")
-                time.sleep(REQUEST_DELAY)
+        output = client.files.download(file=job.dest.file_name).decode('utf-8')
+    except Exception as e:
+        print(f"Batch job failed ({e}), sending online requests instead")
+        return False
+
+    results = {}
+    for line in output.splitlines():
+        if line.strip():
+            result = loads_json(line)
+            results[result.get('key')] = result
 
+    # Fan out the batch results to one output file per prompt
+    for filename, prompt in prompts.items():
+        output_path = os.path.join(OUTPUT_DIR, filename)
+        try:
+            response, generated = batch_response_text(results.get(filename, {}))
+            await asyncio.to_thread(write_output, output_path, response)
+            if generated:
+                await asyncio.to_thread(response_cache.save, prompt, response)
+            record = {
+                'filename': filename,
+                'status': 'success',
+                'prompt_length': len(prompt),
+                'response_length': len(response)
+            }
+            print(f"✓ Saved response to: {output_path}")
         except Exception as e:
             error_msg = f"Error processing {filename}: {str(e)}"
             print(f"✗ {error_msg}")
-
-            # Save error to output file
-            with open(output_path, 'w', encoding='utf-8') as f:
-                f.write(f"ERROR: {error_msg}\n\nPrompt file: {filename}\nModel: {MODEL_NAME}\nTime: {datetime.now().isoformat()}")
-
-            results_summary.append({
+            await asyncio.to_thread(
+                write_output, output_path,
+                f"ERROR: {error_msg}\n\nPrompt file: {filename}\nModel: {MODEL_NAME}\nTime: {datetime.now().isoformat()}"
+            )
+            record = {
                 'filename': filename,
                 'status': 'error',
                 'error': str(e)
-            })
+            }
+        summary_log.write(dumps_json(record) + '\n')
+
+    # Prompts missing from the results were logged as errors and are retried by the next run
+    clear_batch_job(job_path)
+    return True
+
+async def process_online(model, pending, summary_log, processes=1):
+    """Process prompt files concurrently, within a 1/processes share of the request quota."""
+    # Bounded by the semaphore and the rate limiter, logging each result
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS // processes)
+    limiter = AsyncRateLimiter(REQUESTS_PER_MINUTE / processes, 60) if REQUESTS_PER_MINUTE else None
+    await asyncio.gather(*(
+        process_file(model, entry, i, len(pending), semaphore, limiter, summary_log)
+        for i, entry in enumerate(pending, 1)
+    ))
+
+def process_shard(filenames, processes):
+    """Process the named prompt files in a worker process with its own model and event loop."""
+    pending = list_prompt_files(INPUT_DIR, filenames)
+    if not pending:
+        return
+
+    model = setup_api()
+    if not model:
+        return
+
+    # Records are appended one line per write, so shards can share the log
+    summary_log_path = os.path.join(OUTPUT_DIR, SUMMARY_LOG)
+    with open(summary_log_path, 'a', encoding='utf-8', buffering=1) as summary_log:
+        asyncio.run(process_online(model, pending, summary_log, processes))
+
+async def process_prompts():
+    """Main function to process all prompts."""
+    # Create output directory
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+    # Check if input directory exists
+    if not os.path.exists(INPUT_DIR):
+        print(f"Input directory '{INPUT_DIR}' not found. Creating it...")
+        os.makedirs(INPUT_DIR, exist_ok=True)
+        print(f"Please add your prompt files (.txt) to the '{INPUT_DIR}' directory")
+        return
+
+    # Setup API
+    model = setup_api()
+    if not model:
+        return
+
+    # Get all text files in input directory
+    txt_files = list_prompt_files(INPUT_DIR)
+
+    if not txt_files:
+        print(f"No .txt files found in '{INPUT_DIR}' directory")
+        return
+
+    print(f"Found {len(txt_files)} prompt files to process")
+
+    # Skip files that were processed successfully by a previous run
+    summary_log_path = os.path.join(OUTPUT_DIR, SUMMARY_LOG)
+    done = {r['filename'] for r in read_summary_log(summary_log_path) if r['status'] == 'success'}
+    pending = [e for e in txt_files if e.name not in done]
+    if len(pending) < len(txt_files):
+        print(f"Skipping {len(txt_files) - len(pending)} files already processed (listed in {summary_log_path})")
+
+    with open(summary_log_path, 'a', encoding='utf-8', buffering=1) as summary_log:
+        # Large runs go through the Batch API, small ones (or a failed batch) online
+        batched = False
+        if BATCH_MIN_FILES and len(pending) >= BATCH_MIN_FILES:
+            print(f"Submitting {len(pending)} prompts as a batch job")
+            batched = await process_prompts_batch(pending, summary_log)
+
+        if not batched:
+            print(f"Sending up to {MAX_CONCURRENT_REQUESTS} requests concurrently")
+
+            if REQUESTS_PER_MINUTE:
+                print(f"Rate limiting enabled: {REQUESTS_PER_MINUTE} requests per minute")
+
+            processes = min(shard_count(NUM_PROCESSES, MAX_CONCURRENT_REQUESTS, REQUESTS_PER_MINUTE),
+                            len(pending))
+            if processes > 1:
+                print(f"Sharding files across {processes} processes")
+                await asyncio.to_thread(run_sharded, process_shard, pending, processes)
+            else:
+                await process_online(model, pending, summary_log)
+
+    # Latest result of every prompt file, across resumed runs
+    latest = {r['filename']: r for r in read_summary_log(summary_log_path)}
+    results_summary = [latest[e.name] for e in txt_files if e.name in latest]
 
     # Save summary
     summary_path = os.path.join(OUTPUT_DIR, 'processing_summary.json')
-    with open(summary_path, 'w', encoding='utf-8') as f:
-        json.dump({
-            'model': MODEL_NAME,
-            'timestamp': datetime.now().isoformat(),
-            'total_files': len(txt_files),
-            'successful': len([r for r in results_summary if r['status'] == 'success']),
-            'failed': len([r for r in results_summary if r['status'] == 'error']),
-            'generation_config': {
-                'max_output_tokens': MAX_OUTPUT_TOKENS,
-                'temperature': TEMPERATURE,
-                'top_p': TOP_P
-            },
-            'results': results_summary
-        }, f, indent=2)
+    summary = {
+        'model': MODEL_NAME,
+        'timestamp': datetime.now().isoformat(),
+        'total_files': len(txt_files),
+        'successful': len([r for r in results_summary if r['status'] == 'success']),
+        'failed': len([r for r in results_summary if r['status'] == 'error']),
+        'generation_config': GENERATION_CONFIG,
+        'results': results_summary
+    }
+    if orjson is not None:
+        with open(summary_path, 'wb') as f:
+            f.write(orjson.dumps(summary, option=orjson.OPT_INDENT_2))
+    else:
+        with open(summary_path, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
 
     print(f"\n=== Processing Complete ===")
     print(f"Total files: {len(txt_files)}")
@@ -195,7 +499,7 @@ def process_prompts():
     print(f"Failed: {len([r for r in results_summary if r['status'] == 'error'])}")
     print(f"Summary saved to: {summary_path}")
 
-def test_api_connection():
+async def test_api_connection():
     """Test the API connection with a simple prompt."""
     print("Testing API connection...")
 
@@ -205,19 +509,25 @@ def test_api_connection():
 
     try:
         test_prompt = "Say 'Hello, this is a test of the Google AI Studio API connection.'"
-        response = generate_response(model, test_prompt)
-
-        if "Error" in response:
-            print(f"API test failed: {response}")
-            return False
-        else:
-            print(f"✓ API test successful: {response[:100]}...")
-            return True
+        response = await generate_response(model, test_prompt, use_cache=False)
+        print(f"✓ API test successful: {response[:100]}...")
+        return True
 
     except Exception as e:
         print(f"API test failed: {e}")
         return False
 
+async def run():
+    """Test the API connection, then process all prompts in one event loop."""
+    # Test API connection first
+    if not await test_api_connection():
+        print("\nAPI connection test failed. Please check your API key and try again.")
+        return
+
+    print()
+
+    await process_prompts()
+
 def main():
     """Main entry point."""
     print("=== Google AI Studio Model Prompting Script ===")
@@ -226,15 +536,8 @@ def main():
     print(f"Output directory: {OUTPUT_DIR}")
     print()
 
-    # Test API connection first
-    if not test_api_connection():
-        print("\nAPI connection test failed. Please check your API key and try again.")
-        return
-
-    print()
-
     try:
-        process_prompts()
+        asyncio.run(run())
     except KeyboardInterrupt:
         print("\n\nProcessing interrupted by user")
     except Exception as e:
@@ -5,9 +5,12 @@ Script that saves only the model responses without prompts or metadata.
 
 import os
 import json
-import time
-import google.generativeai as genai
+import asyncio
 from datetime import datetime
+from rate_limiter import AsyncRateLimiter
+from gemini_utils import (ResponseCache, with_retries,
+                          list_prompt_files, read_prompt, write_output,
+                          shard_count, run_sharded)
 
 # === Configuration ===
 MODEL_NAME = "model_name"
@@ -18,7 +21,29 @@ OUTPUT_DIR = "output_directory"
 MAX_OUTPUT_TOKENS = 2048
 TEMPERATURE = 0.7
 TOP_P = 0.9
-REQUEST_DELAY = 1  # seconds between requests
+REQUESTS_PER_MINUTE = 60  # request quota, enforced with a token bucket (None to disable)
+MAX_CONCURRENT_REQUESTS = 8  # requests in flight at the same time
+MMAP_MIN_SIZE = 4096  # prompt files larger than this (bytes) are read through mmap
+NUM_PROCESSES = 1  # worker processes, each with its own event loop and an equal share of the quota
+
+# Built once and shared by every model instance; the SDK accepts a plain mapping
+GENERATION_CONFIG = {
+    'max_output_tokens': MAX_OUTPUT_TOKENS,
+    'temperature': TEMPERATURE,
+    'top_p': TOP_P,
+}
+
+# Retries of transient API errors (rate limits, overload, timeouts)
+MAX_ATTEMPTS = 5
+RETRY_INITIAL_DELAY = 1  # seconds, doubled after every failed attempt
+RETRY_MAX_DELAY = 30
+
+# Response cache, keyed by model, generation parameters and prompt (None to disable).
+# Generation is sampled, so a cache hit returns an old sample instead of a new one:
+# only set it (e.g. ".llm_cache") to re-run with the same responses.
+CACHE_DIR = None
+
+response_cache = ResponseCache(MODEL_NAME, GENERATION_CONFIG, CACHE_DIR)
 
 def setup_api():
     """Initialize the Google AI Studio API."""
@@ -33,35 +58,95 @@ def setup_api():
         return None
 
     try:
+        import google.generativeai as genai
         genai.configure(api_key=api_key)
         model = genai.GenerativeModel(
             model_name=MODEL_NAME,
-            generation_config=genai.types.GenerationConfig(
-                max_output_tokens=MAX_OUTPUT_TOKENS,
-                temperature=TEMPERATURE,
-                top_p=TOP_P,
-            )
+            generation_config=GENERATION_CONFIG,
         )
         return model
     except Exception as e:
         print(f"Error setting up API: {e}")
         return None
 
-def generate_response(model, prompt):
-    """Generate clean response."""
-    try:
-        response = model.generate_content(prompt)
+async def generate_response(model, prompt, use_cache=True, limiter=None):
+    """Generate clean response.
 
-        if response.candidates[0].finish_reason.name == "SAFETY":
-            return "[Response blocked by safety filters]"
+    Transient API errors are retried; errors that persist are raised.
+    """
+    if use_cache:
+        cached = await asyncio.to_thread(response_cache.load, prompt)
+        if cached is not None:
+            return cached
 
-        if response.candidates[0].finish_reason.name == "RECITATION":
-            return "[Response blocked due to recitation concerns]"
+    async def send():
+        if limiter is not None:
+            await limiter.acquire()
 
-        return response.text.strip() if response.text else "[No response generated]"
+        return await model.generate_content_async(prompt)
 
-    except Exception as e:
-        return f"[Error: {str(e)}]"
+    response = await with_retries(send, MAX_ATTEMPTS, RETRY_INITIAL_DELAY, RETRY_MAX_DELAY)
+
+    if response.candidates[0].finish_reason.name == "SAFETY":
+        return "[Response blocked by safety filters]"
+
+    if response.candidates[0].finish_reason.name == "RECITATION":
+        return "[Response blocked due to recitation concerns]"
+
+    if not response.text:
+        return "[No response generated]"
+
+    text = response.text.strip()
+    if use_cache:
+        await asyncio.to_thread(response_cache.save, prompt, text)
+    return text
+
+async def process_file(model, entry, index, total, semaphore, limiter):
+    """Generate and save the clean response for a single prompt file."""
+    filename = entry.name
+    output_path = os.path.join(OUTPUT_DIR, filename)
+
+    async with semaphore:
+        print(f"[{index}/{total}] {filename}")
+
+        try:
+            # Read prompt (file I/O runs in a worker thread, overlapping other requests)
+            prompt = await asyncio.to_thread(read_prompt, entry, MMAP_MIN_SIZE)
+
+            if not prompt:
+                return
+
+            # Generate and save clean response
+            response = await generate_response(model, prompt, limiter=limiter)
+
+            await asyncio.to_thread(write_output, output_path, response)
+
+            print(f"  ✓ Response saved: {filename}")
+
+        except Exception as e:
+            print(f"  ✗ Error ({filename}): {e}")
+            await asyncio.to_thread(write_output, output_path, f"[Processing Error: {str(e)}]")
+
+async def process_all(model, txt_files, processes=1):
+    """Process prompt files concurrently, within a 1/processes share of the request quota."""
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS // processes)
+    limiter = AsyncRateLimiter(REQUESTS_PER_MINUTE / processes, 60) if REQUESTS_PER_MINUTE else None
+    await asyncio.gather(*(
+        process_file(model, entry, i, len(txt_files), semaphore, limiter)
+        for i, entry in enumerate(txt_files, 1)
+    ))
+
+def process_shard(filenames, processes):
+    """Process the named prompt files in a worker process with its own model and event loop."""
+    txt_files = list_prompt_files(INPUT_DIR, filenames)
+    if not txt_files:
+        return
+
+    model = setup_api()
+    if not model:
+        return
+
+    asyncio.run(process_all(model, txt_files, processes))
 
 def main():
     """Main processing function."""
@@ -79,7 +164,7 @@ def main():
         return
 
     # Get prompt files
-    txt_files = [f for f in os.listdir(INPUT_DIR) if f.endswith('.txt')]
+    txt_files = list_prompt_files(INPUT_DIR)
 
     if not txt_files:
         print(f"No .txt files found in {INPUT_DIR}/")
@@ -87,37 +172,14 @@ def main():
 
     print(f"Processing {len(txt_files)} files...")
 
-    # Process each file
-    for i, filename in enumerate(txt_files, 1):
-        print(f"[{i}/{len(txt_files)}] {filename}")
-
-        input_path = os.path.join(INPUT_DIR, filename)
-        output_path = os.path.join(OUTPUT_DIR, filename)
-
-        try:
-            # Read prompt
-            with open(input_path, 'r', encoding='utf-8') as f:
-                prompt = f.read().strip()
-
-            if not prompt:
-                continue
-
-            # Generate and save clean response
-            response = generate_response(model, prompt)
-
-            with open(output_path, 'w', encoding='utf-8') as f:
-                f.write(response)
-
-            print(f"  ✓ Response saved")
-
-            # Rate limiting
-            if REQUEST_DELAY > 0 and i < len(txt_files):
-                time.sleep(REQUEST_DELAY)
-
-        except Exception as e:
-            print(f"  ✗ Error: {e}")
-            with open(output_path, 'w', encoding='utf-8') as f:
-                f.write(f"[Processing Error: {str(e)}]")
+    processes = min(shard_count(NUM_PROCESSES, MAX_CONCURRENT_REQUESTS, REQUESTS_PER_MINUTE),
+                    len(txt_files))
+    if processes > 1:
+        print(f"Sharding files across {processes} processes")
+        run_sharded(process_shard, txt_files, processes)
+    else:
+        # Process all files concurrently
+        asyncio.run(process_all(model, txt_files))
 
     print(f"\nComplete! Clean responses saved to {OUTPUT_DIR}/")
 
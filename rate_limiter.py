@@ -0,0 +1,42 @@
+"""
+Token-bucket rate limiter for asyncio API clients.
+"""
+
+import time
+import asyncio
+
+class AsyncRateLimiter:
+    """Allow max_rate acquisitions per time_period seconds, bursting up to max(1, max_rate) at once."""
+
+    def __init__(self, max_rate, time_period=60):
+        if max_rate <= 0 or time_period <= 0:
+            raise ValueError("max_rate and time_period must be positive")
+        self.max_rate = max_rate
+        self.time_period = time_period
+        # The bucket holds at least one token, so rates below one per period still pass
+        self._capacity = max(1, max_rate)
+        self._tokens = self._capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self._capacity,
+                           self._tokens + (now - self._updated) * self.max_rate / self.time_period)
+        self._updated = now
+
+    async def acquire(self):
+        """Wait until a token is available and take it; waiters are served in order."""
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) * self.time_period / self.max_rate)
+                self._refill()
+            self._tokens -= 1
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False